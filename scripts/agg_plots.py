@@ -1,130 +1,88 @@
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from PIL import Image
 import urllib
 import os
+import hashlib
+
+# FUNCTIONS
+def read_csv_cached(csv_path, **read_csv_kwargs):
+    """
+    Read a CSV file, caching a Parquet copy alongside it.
+
+    The copy is named after the CSV and the read arguments (e.g.
+    'aggregates.csv.1a2b3c4d.parquet'), so it never collides with other files
+    and a read with different arguments does not reuse it. It is reused as long
+    as it is at least as new as the CSV, so repeat runs skip CSV parsing.
+
+    Args:
+        csv_path (str): Path to the CSV file.
+        **read_csv_kwargs: Extra keyword arguments passed to pandas.read_csv.
+
+    Returns:
+        pandas.DataFrame: The contents of the CSV file.
+    """
+    kwargs_key = hashlib.sha1(repr(sorted(read_csv_kwargs.items())).encode()).hexdigest()[:8]
+    parquet_path = f'{csv_path}.{kwargs_key}.parquet'
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+        return pd.read_parquet(parquet_path, engine='pyarrow')
+
+    df = pd.read_csv(csv_path, **read_csv_kwargs)
+    df.to_parquet(parquet_path, engine='pyarrow', index=False)
+    return df
 
 # DATA IMPORT
 # Read aggregates data into data frame
-df_aggregates = pd.read_csv('Users/kserickson/Documents/zsr/data/aggregates.csv')
-df_2022 = pd.read_csv('Users/kserickson/Documents/zsr/data/2022.csv')
+df_aggregates = read_csv_cached('Users/kserickson/Documents/zsr/data/aggregates.csv')
+df_2022 = read_csv_cached('Users/kserickson/Documents/zsr/data/2022.csv')
 
 
 # DATA VISUALIZATION
 # Create a table of the books read by year
-fig = plt.figure(figsize=(18,10), dpi=300)
-ax = plt.subplot()
+fig, ax = plt.subplots(figsize=(18,10), dpi=100)
 
-ncols = 8
-nrows = df_aggregates.shape[0]
-
-ax.set_xlim(0, ncols + 1)
-ax.set_ylim(0, nrows + 1)
-
-positions = [0.25, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5, 8.5]
 columns = ['year_completed', 'count', 'sum_length', 'avg_length', 'avg_duration', 'length_per_month', 'length_per_week', 'length_per_day']
-
-for i in range (nrows):
-    for j, column in enumerate(columns):
-        if j == 0:
-            ha = 'left'
-        else:
-            ha = 'center'
-        if column == 'count':
-            text_label = f'{df_aggregates[column].iloc[i]}'
-            weight = 'bold'
-        else:
-            text_label = f'{df_aggregates[column].iloc[i]}'
-        ax.annotate(
-            xy=(positions[j], i + .5),
-            text=text_label,
-            ha=ha,
-            va='center',
-        )
-
 column_names = ['Year', 'Books', 'Total Pages', 'Avg Length', 'Avg Days to Complete', 'Pages per Month', 'Pages per Week', 'Pages per Day']
-for index, c in enumerate(column_names):
-        if index == 0:
-            ha = 'left'
-        else:
-            ha = 'center'
-        ax.annotate(
-            xy=(positions[index], nrows + .25),
-            text=column_names[index],
-            ha=ha,
-            va='bottom',
-            weight='bold'
-        )
 
-# Add dividing lines
-ax.plot([ax.get_xlim()[0], ax.get_xlim()[1]], [nrows, nrows], lw=1.5, color='black', marker='', zorder=4)
-ax.plot([ax.get_xlim()[0], ax.get_xlim()[1]], [0, 0], lw=1.5, color='black', marker='', zorder=4)
-for x in range(1, nrows):
-    ax.plot([ax.get_xlim()[0], ax.get_xlim()[1]], [x, x], lw=1.15, color='gray', ls=':', zorder=3 , marker='')
+# Build every cell in a single table call rather than annotating cell by cell
+cell_text = df_aggregates[columns].astype(str).to_numpy().tolist()
+tbl = ax.table(cellText=cell_text, colLabels=column_names, colLoc='center', cellLoc='center', loc='center')
+tbl.auto_set_font_size(False)
+tbl.set_fontsize(9)
+for j in range(len(column_names)):
+    tbl[(0, j)].set_text_props(weight='bold')
 
 ax.set_axis_off()
-plt.savefig(
-    '/Users/kserickson/Documents/zsr/figures/agg_books_by_year.png',
-    dpi=300,
-    transparent=True,
-    bbox_inches='tight'
+fig.tight_layout()
+fig.savefig(
+    '/Users/kserickson/Documents/zsr/figures/agg_books_by_year.svg',
+    format='svg',
+    transparent=True
 )
+plt.close(fig)
 
-# Create a table of the books I read in df_2022
-fig = plt.figure(figsize=(40,20), dpi=300)
-ax = plt.subplot()
-
-ncols = 7
+# Create a table of the books I read in df_2022, sizing the figure to the number of rows
 nrows = df_2022.shape[0]
+fig, ax = plt.subplots(figsize=(12, max(4, 0.25 * nrows)), dpi=100)
 
-ax.set_xlim(0, ncols + 1)
-ax.set_ylim(0, nrows + 1)
-
-positions = [0.25, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5]
 columns = ['title', 'creators', 'library', 'began', 'completed', 'duration', 'length']
-
-for i in range (nrows):
-    for j, column in enumerate(columns):
-        if j == 0:
-            ha = 'left'
-        else:
-            ha = 'center'
-        if column == 'duration':
-            text_label = f'{df_2022[column].iloc[i]}'
-            weight = 'bold'
-        else:
-            text_label = f'{df_2022[column].iloc[i]}'
-        ax.annotate(
-            xy=(positions[j], i + .5),
-            text=text_label,
-            ha=ha,
-            va='center',
-        )
-
 column_names = ['Title', 'Authors', 'Library', 'Began', 'Completed', 'Days', 'Pages']
-for index, c in enumerate(column_names):
-        if index == 0:
-            ha = 'left'
-        else:
-            ha = 'center'
-        ax.annotate(
-            xy=(positions[index], nrows + .25),
-            text=column_names[index],
-            ha=ha,
-            va='bottom',
-            weight='bold'
-        )
 
-# Add dividing lines
-ax.plot([ax.get_xlim()[0], ax.get_xlim()[1]], [nrows, nrows], lw=1.5, color='black', marker='', zorder=4)
-ax.plot([ax.get_xlim()[0], ax.get_xlim()[1]], [0, 0], lw=1.5, color='black', marker='', zorder=4)
-for x in range(1, nrows):
-    ax.plot([ax.get_xlim()[0], ax.get_xlim()[1]], [x, x], lw=1.15, color='gray', ls=':', zorder=3 , marker='')
+# Build every cell in a single table call rather than annotating cell by cell
+cell_text = df_2022[columns].astype(str).to_numpy().tolist()
+tbl = ax.table(cellText=cell_text, colLabels=column_names, colLoc='center', cellLoc='center', loc='center')
+tbl.auto_set_font_size(False)
+tbl.set_fontsize(9)
+for j in range(len(column_names)):
+    tbl[(0, j)].set_text_props(weight='bold')
 
 ax.set_axis_off()
-plt.savefig(
-    '/Users/kserickson/Documents/zsr/figures/2022books.png',
-    dpi=300,
-    transparent=True,
-    bbox_inches='tight'
+fig.tight_layout()
+fig.savefig(
+    '/Users/kserickson/Documents/zsr/figures/2022books.svg',
+    format='svg',
+    transparent=True
 )
+plt.close(fig)
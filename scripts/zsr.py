@@ -4,6 +4,7 @@ import datetime
 import json
 import os
 import logging
+import hashlib
 
 # CONFIGURATION
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,6 +19,10 @@ DATA_DIR = os.path.join(ROOT_DIR, 'data')
 MISSING_DATA_FILE = os.path.join(DATA_DIR, 'missing_data.json')
 LOG_FILE_PATH = config.get('log_file_path')
 OUTPUT_PATH = config.get('output_paths', '')
+CACHE_KEY_FILE = os.path.join(OUTPUT_PATH.get('data', ''), '.cache_key')
+
+# Columns used from each library export; all others are skipped when reading
+KEEP_COLS = ['title', 'creators', 'publisher', 'publish_date', 'began', 'completed', 'added', 'length', 'status', 'ean_isbn13']
 
 #Configure logging
 logging.basicConfig(
@@ -37,63 +42,32 @@ def load_missing_data(filename=MISSING_DATA_FILE):
         return None
 
 def clean_data(df_library, missing_data):
-    # Drop unneeded columns
-    df_library.drop(columns=[
-        'item_type',
-        'first_name',
-        'last_name',
-        'description',
-        'group',
-        'tags',
-        'notes',
-        'price',
-        'number_of_discs',
-        'number_of_players',
-        'age_group',
-        'ensemble',
-        'aspect_ratio',
-        'esrb',
-        'rating',
-        'review',
-        'review_date',
-        'copies',
-        'upc_isbn10'
-    ], inplace=True)
-
     # Strip whitespace
-    df_library['status'] = df_library['status'].str.strip()
     df_library['began'] = df_library['began'].str.strip()
     df_library['completed'] = df_library['completed'].str.strip()
 
     # Cast columns as correct data types while filling in any missing values
     df_library['length'] = df_library['length'].fillna(0).astype(int)
-    df_library['publish_date'] = pd.to_datetime(df_library['publish_date'], format='%Y-%m-%d', errors="coerce")
     df_library['began'] = pd.to_datetime(df_library['began'], format='%Y-%m-%d', errors='raise')
     df_library['completed'] = pd.to_datetime(df_library['completed'], format='%Y-%m-%d', errors='raise')
+    df_library['publish_date'] = pd.to_datetime(df_library['publish_date'], format='%Y-%m-%d', errors="coerce")
     df_library['added'] = pd.to_datetime(df_library['added'], format='%Y-%m-%d', errors='coerce')
-    df_library['ean_isbn13'] = df_library['ean_isbn13'].astype(str).str.replace(r'\.0$', '', regex=True)
+    df_library['ean_isbn13'] = df_library['ean_isbn13'].fillna('nan')
 
-    # Fill in missing data using the missing_data dictionary
+    # Fill in missing data using the missing_data dictionary, looking up every fix for a title at once
     if missing_data is not None:
-        # Fill in missing lengths
-        if 'missing_lengths' in missing_data:
-            for title, length in missing_data['missing_lengths'].items():
-                df_library.loc[df_library['title'] == title, 'length'] = length
-
-        # Fill in missing ISBN13 values
-        if 'missing_isbn13' in missing_data:
-            for title, isbn13 in missing_data['missing_isbn13'].items():
-                df_library.loc[df_library['title'] == title, 'ean_isbn13'] = isbn13
-
-        # Fill in missing publishers
-        if 'missing_publishers' in missing_data:
-            for title, publisher in missing_data['missing_publishers'].items():
-                df_library.loc[df_library['title'] == title, 'publisher'] = publisher
-
-        # Fill in missing publication dates
-        if 'missing_publish_dates' in missing_data:
-            for title, publish_date in missing_data['missing_publish_dates'].items():
-                df_library.loc[df_library['title'] == title, 'publish_date'] = publish_date
+        df_fixes = pd.DataFrame({
+            'length': missing_data.get('missing_lengths', {}),
+            'ean_isbn13': missing_data.get('missing_isbn13', {}),
+            'publisher': missing_data.get('missing_publishers', {}),
+            'publish_date': missing_data.get('missing_publish_dates', {})
+        })
+        df_fixes = df_fixes.reindex(df_library['title'].to_numpy()).set_axis(df_library.index)
+        df_fixes['publish_date'] = pd.to_datetime(df_fixes['publish_date'], format='ISO8601')
+
+        for column in df_fixes.columns:
+            df_library[column] = df_fixes[column].fillna(df_library[column])
+        df_library['length'] = df_library['length'].astype(int)
 
     # Check for missing page lengths
     df_missing_pgs = df_library[(df_library['length'] == 0)]
@@ -130,79 +104,113 @@ def clean_data(df_library, missing_data):
 
 def add_derived_columns(df_library, df_daily):
     # Type converstions for df_daily before merging
-    df_daily['ean_isbn13'] = df_daily['ean_isbn13'].astype(str)
+    df_daily['ean_isbn13'] = df_daily['ean_isbn13'].fillna('nan')
     df_daily['title'] = df_daily['title'].astype(str)
+
+    # Give both frames the same title categories so the merge below compares integer codes
+    title_categories = pd.api.types.union_categoricals(
+        [df_library['title'].astype('category'), df_daily['title'].astype('category')],
+        sort_categories=True
+    ).categories
+    df_library['title'] = pd.Categorical(df_library['title'], categories=title_categories)
+    df_daily['title'] = pd.Categorical(df_daily['title'], categories=title_categories)
     df_daily['date'] = pd.to_datetime(df_daily['date'], format='%Y-%m-%d', errors='coerce')
 
     # Compute the number of days between the began and completed dates and add it to a new column: duration
-    df_library['duration'] = (df_library['completed'] - df_library['began']).apply(lambda x: x.days + 1)
-    df_library['duration'] = df_library['duration'].round().fillna(0).astype(int)
+    delta_days = (df_library['completed'] - df_library['began']).dt.days
+    df_library['duration'] = (delta_days + 1).fillna(0).astype('int32')
 
     # Extract the year from the completed date and add it to a new column: year_completed
-    df_library['year_completed'] = df_library['completed'].apply(lambda x: x.year).astype(str)
-    df_library['year_completed'] = df_library['year_completed'].str.replace(r'\.0$', '', regex=True)
+    df_library['year_completed'] = df_library['completed'].dt.year.astype('Int16').astype('string').fillna('nan')
 
     # Create new DataFrame by merging df_daily and df_library, filter to books in progress only
     df_dailies = pd.merge(df_daily, df_library, how='left', on=['ean_isbn13', 'title'])
     df_dailies = df_dailies[df_dailies['status'].isin(['In progress', 'Completed'])]
 
+    # Titles go back to plain strings so that the days added below can leave them empty
+    df_dailies['title'] = df_dailies['title'].astype(str)
+
     drop_columns = ['creators', 'publisher', 'publish_date', 'status', 'began', 'completed', 'added', 'library', 'duration', 'year_completed']
     df_dailies = df_dailies.drop(columns=drop_columns)
 
-    # Add percent_complete column
-    df_dailies['percent_complete'] = df_dailies['end_page'] / df_dailies['length'] * 100
-    df_dailies['percent_complete'] = df_dailies['percent_complete'].round(2)
+    # Add percent_complete column, leaving books with no known length at 0 instead of inf
+    end_page = df_dailies['end_page'].to_numpy(dtype=np.float64)
+    length = df_dailies['length'].to_numpy(dtype=np.float64)
+    percent_complete = np.divide(end_page * 100, length, out=np.zeros_like(end_page), where=length != 0)
+    df_dailies['percent_complete'] = percent_complete.round(2).astype(np.float32)
 
     # Add daily_pages column
     df_dailies['daily_pages'] = df_dailies['end_page'] - df_dailies['start_page']
 
-    # Add rows for days when no pages were read
-    min_date = df_dailies['date'].min()
-    max_date = df_dailies['date'].max()
-    all_dates = pd.date_range(start=min_date, end=max_date, freq='D')
-    df_dates = pd.DataFrame({'date': all_dates})
-    df_dailies = pd.merge(df_dates, df_dailies, on='date', how='left')
-    numeric_cols = df_dailies.select_dtypes(include=['int64', 'float64']).columns
-    df_dailies[numeric_cols] = df_dailies[numeric_cols].fillna(0)
+    # Add rows for days when no pages were read. A day can have rows for several books, so
+    # append the missing days rather than reindexing on a non-unique date index
+    all_dates = pd.date_range(start=df_dailies['date'].min(), end=df_dailies['date'].max(), freq='D')
+    missing_dates = all_dates.difference(df_dailies['date'])
+    df_dailies = pd.concat([df_dailies.dropna(subset=['date']), pd.DataFrame({'date': missing_dates})], ignore_index=True)
+    df_dailies = df_dailies.sort_values(by='date', kind='stable', ignore_index=True)
+
+    # Zero out the numeric columns on the added days
+    for column in ['start_page', 'end_page', 'length', 'daily_pages']:
+        df_dailies[column] = df_dailies[column].fillna(0).astype('int32')
+    df_dailies['percent_complete'] = df_dailies['percent_complete'].fillna(0).astype(np.float32)
 
     return df_dailies
 
 def add_aggregate_columns(df_library):
     # Create a dataframe that aggregates book and page totals and averages by year completed
-    df_completed = df_library[(df_library['status'] == "Completed")]
-
-    df_completed = df_library[(df_library['status'] == "Completed") & (df_library['year_completed'] != "nan")].sort_values(by='year_completed')
+    is_completed = df_library['status'].eq("Completed")
+    has_year = df_library['year_completed'].ne("nan")
+    df_completed = df_library[is_completed & has_year].sort_values(by='year_completed', kind='mergesort')
     
-    df_aggregates = df_completed.groupby('year_completed').agg(
-        count=('year_completed', 'count'),
+    df_aggregates = df_completed.groupby('year_completed', sort=False).agg(
+        count=('year_completed', 'size'),
         sum_length=('length', 'sum'),
         avg_length=('length', 'mean'),
-        avg_duration=('duration', 'mean'),
-        length_per_month=('length', lambda x: x.sum() / 12),
-        length_per_week=('length', lambda x: x.sum() / 52),
-        length_per_day=('length', lambda x: x.sum() / 365)
+        avg_duration=('duration', 'mean')
     ).reset_index()
 
-    df_aggregates[['avg_length', 'avg_duration', 'length_per_month', 'length_per_week', 'length_per_day']] = df_aggregates[['avg_length', 'avg_duration', 'length_per_month', 'length_per_week', 'length_per_day']].apply(lambda x: x.round(2))
+    # Derive the per-period page rates from the yearly page totals
+    df_aggregates['length_per_month'] = df_aggregates['sum_length'] / 12
+    df_aggregates['length_per_week'] = df_aggregates['sum_length'] / 52
+    df_aggregates['length_per_day'] = df_aggregates['sum_length'] / 365
+
+    rounded_columns = ['avg_length', 'avg_duration', 'length_per_month', 'length_per_week', 'length_per_day']
+    df_aggregates[rounded_columns] = df_aggregates[rounded_columns].round(2)
 
     return df_aggregates
 
-def save_dataframes(df_library, df_aggregates, df_dailies, config):
+def save_dataframes(df_library, df_aggregates, df_dailies, config, file_format='parquet'):
     # Access 'output_dir' from the global configuration
     data_output_path = OUTPUT_PATH.get('data', '')
 
-    # Define file paths for CSV files
-    library_csv_path = os.path.join(data_output_path, 'library.csv')
+    # Define file paths for output files. The library and dailies are only read back by
+    # zsr_plots.py, so they are written as Parquet unless CSV is requested
+    library_path = os.path.join(data_output_path, f'library.{file_format}')
     aggregates_csv_path = os.path.join(data_output_path, 'aggregates.csv')
-    dailies_csv_path = os.path.join(data_output_path, 'dailies.csv')
+    dailies_path = os.path.join(data_output_path, f'dailies.{file_format}')
 
     try:
-        # Save DataFrames to CSV files
-        df_library.to_csv(library_csv_path, index=False)
+        # Save DataFrames to files
+        if file_format == 'parquet':
+            df_library.to_parquet(library_path, engine='pyarrow', compression='zstd', index=False)
+            df_dailies.to_parquet(dailies_path, engine='pyarrow', compression='zstd', index=False)
+        else:
+            df_library.to_csv(library_path, index=False)
+            df_dailies.to_csv(dailies_path, index=False)
         df_aggregates.to_csv(aggregates_csv_path, index=False)
-        df_dailies.to_csv(dailies_csv_path, index=False)
     except Exception as e:
-        logging.error(f"Error saving DataFrames to CSV files: {e}")
+        logging.error(f"Error saving DataFrames to files: {e}")
+        return False
+
+    return True
+
+def compute_cache_key(file_paths):
+    # Fingerprint the inputs by path, modification time and size; missing files still count
+    stats = sorted(
+        (path, os.path.getmtime(path), os.path.getsize(path)) if os.path.exists(path) else (path, None, None)
+        for path in file_paths
+    )
+    return hashlib.sha1(repr(stats).encode()).hexdigest()
 
 def main():
     # Load missing data
@@ -211,6 +219,18 @@ def main():
     # Extract data file paths
     data_paths = config.get('input_paths', {})
 
+    # Skip the pipeline if the inputs, missing data, this script and the outputs are unchanged
+    # since the last successful run. Including the outputs means deleted or replaced outputs get rebuilt
+    input_files = [path for name, path in data_paths.items() if name not in ["dailies", "library"]]
+    output_files = [os.path.join(OUTPUT_PATH.get('data', ''), name) for name in ['library.parquet', 'aggregates.csv', 'dailies.parquet']]
+    cache_files = input_files + [MISSING_DATA_FILE, os.path.abspath(__file__)] + output_files
+    cache_key = compute_cache_key(cache_files)
+    if os.path.exists(CACHE_KEY_FILE):
+        with open(CACHE_KEY_FILE, 'r') as cache_key_file:
+            if cache_key_file.read().strip() == cache_key:
+                logging.info("Inputs unchanged since the last run; skipping the pipeline")
+                return
+
     # Create an empty list to store DataFrames
     dfs = []
 
@@ -218,15 +238,25 @@ def main():
     for library, file_path in data_paths.items():
         if library not in ["daily", "dailies", "library"]:
             # Read the CSV file and add the 'library' column
-            df = pd.read_csv(file_path)
+            df = pd.read_csv(
+                file_path,
+                usecols=KEEP_COLS,
+                dtype={'length': 'Int32', 'ean_isbn13': str},
+                parse_dates=['publish_date', 'added'],
+                date_format='%Y-%m-%d'
+            )
             df['library'] = library
             dfs.append(df)
 
     # Concatenate individual library DataFrames into a single DataFrame
     df_library = pd.concat(dfs, ignore_index=True)
 
+    # Store low-cardinality string columns as categories so equality checks compare integer codes
+    df_library['status'] = df_library['status'].str.strip().astype('category')
+    df_library['title'] = df_library['title'].astype('category')
+
     # Create a DataFrame for the daily library
-    df_daily = pd.read_csv(data_paths.get('daily', ''))
+    df_daily = pd.read_csv(data_paths.get('daily', ''), dtype={'ean_isbn13': str})
 
     # Clean and transform data
     clean_data(df_library, missing_data)
@@ -237,8 +267,10 @@ def main():
     # Add aggregate columns
     df_aggregates = add_aggregate_columns(df_library)
 
-    # Save DataFrames to CSV files
-    save_dataframes(df_library, df_aggregates, df_dailies, config)
+    # Save DataFrames to files, recording the inputs they were built from and the outputs just written
+    if save_dataframes(df_library, df_aggregates, df_dailies, config):
+        with open(CACHE_KEY_FILE, 'w') as cache_key_file:
+            cache_key_file.write(compute_cache_key(cache_files))
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,13 @@
 import pandas as pd
 import numpy as np
 import matplotlib as mpl
+mpl.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import matplotlib.patches as patches
 from matplotlib import font_manager
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import seaborn as sns
 import json
 import os
@@ -51,23 +53,63 @@ mpl.rcParams['figure.facecolor'] = facecolors["figure_facecolor"]
 mpl.rcParams['axes.facecolor'] = facecolors["axes_facecolor"]
 
 # FUNCTIONS
+def read_zsr_output(csv_path, **read_csv_kwargs):
+    """
+    Read one of zsr.py's outputs, preferring its Parquet form.
+
+    zsr.py writes the library and dailies as Parquet next to the configured CSV
+    paths. The Parquet file is read when it exists and is at least as new as the
+    CSV; otherwise the CSV is parsed. Nothing is written back, so zsr.py's
+    outputs are never replaced.
+
+    Args:
+        csv_path (str): Path to the CSV form of the output.
+        **read_csv_kwargs: Extra keyword arguments passed to pandas.read_csv. Its
+            usecols, if given, also selects the columns read from Parquet.
+
+    Returns:
+        pandas.DataFrame: The contents of the output.
+    """
+    parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
+    if os.path.exists(parquet_path) and (
+        not os.path.exists(csv_path) or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)
+    ):
+        return pd.read_parquet(parquet_path, engine='pyarrow', columns=read_csv_kwargs.get('usecols'))
+
+    return pd.read_csv(csv_path, **read_csv_kwargs)
+
 def clean_data(df_library, df_dailies):
-    df_library['ean_isbn13'] = df_library['ean_isbn13'].astype(str).str.replace(r'\.0$', '', regex=True)
-    df_dailies['ean_isbn13'] = df_dailies['ean_isbn13'].astype(str).str.replace(r'\.0$', '', regex=True)
-    df_library['title'] = df_library['title'].replace(np.nan, '')
+    df_library['ean_isbn13'] = df_library['ean_isbn13'].astype(str).str.removesuffix('.0')
+    df_dailies['ean_isbn13'] = df_dailies['ean_isbn13'].astype(str).str.removesuffix('.0')
+    df_library['title'] = df_library['title'].astype('string[pyarrow]').fillna('')
     df_dailies['title'] = df_dailies['title'].replace(np.nan, '')
+    df_dailies['title'] = df_dailies['title'].astype('category')
     df_library['began'] = pd.to_datetime(df_library['began'], format='%Y-%m-%d', errors='raise')
     df_library['completed'] = pd.to_datetime(df_library['completed'], format='%Y-%m-%d', errors='raise')
-    df_dailies['date'] = pd.to_datetime(df_dailies['date'], format='%Y-%m-%d', errors="coerce")
-    return df_library
-    return df_dailies
+    return df_library, df_dailies
+
+def year_calendar(year):
+    """
+    Build the date ranges shared by the plots for a year.
 
-def plot_stacked_bar_and_line_charts(df, year):
-    # Filter data for the specified year
-    df = df[df['date'].dt.year == year]
+    Args:
+        year (int): The year to build date ranges for.
 
-    # Create a figure and subplots
-    fig, ax1 = plt.subplots(figsize=(20, 2.5))
+    Returns:
+        dict: 'all_dates' (every day of the year), 'month_starts' (the first day
+        of each month) and 'month_labels' (abbreviated month names).
+    """
+    month_starts = pd.date_range(start=f'{year}-01-01', end=f'{year}-12-31', freq='MS')
+    return {
+        'all_dates': pd.date_range(start=f'{year}-01-01', end=f'{year}-12-31'),
+        'month_starts': month_starts,
+        'month_labels': month_starts.strftime('%b'),
+    }
+
+def plot_stacked_bar_and_line_charts(df, year, calendar, fig):
+    # Clear the figure left over from the previous year and create subplots
+    fig.clear()
+    ax1 = fig.add_subplot()
     ax2 = ax1.twinx()
 
     # Create an array of unique titles for this year's data
@@ -75,23 +117,27 @@ def plot_stacked_bar_and_line_charts(df, year):
     titles = titles[titles != '']
 
     # Create a DataFrame for stacked bar chart
-    grouped = df.groupby(['date', 'title'])['daily_pages'].sum().unstack(fill_value=0)
+    grouped = df.pivot_table(index='date', columns='title', values='daily_pages', aggfunc='sum', fill_value=0, sort=False, observed=True)
 
     # Colors for lines
     colors = sns.color_palette('gist_stern_r', n_colors=len(titles))
 
-    # Initialize vertical offset for stacked bar chart
-    y_offset = np.zeros(len(grouped))
+    # Compute every title's bar offset in a single cumulative sum across titles
+    heights = grouped[titles].to_numpy(dtype=np.float32)
+    bottoms = np.cumsum(heights, axis=1) - heights
 
     # Plot stacked bars
-    for idx, title in enumerate(titles):
-        ax2.bar(grouped.index, grouped[title], bottom=y_offset, color=colors[idx], alpha=0.7)
-        y_offset = y_offset + grouped[title]
-
-    # Plot lines for percent complete
-    for i, title in enumerate(titles):
-        data = df[df['title'] == title]
-        ax1.plot(data['date'], data['percent_complete'], label=title, color=colors[i])
+    for idx in range(len(titles)):
+        ax2.bar(grouped.index, heights[:, idx], bottom=bottoms[:, idx], color=colors[idx], alpha=0.7)
+
+    # Plot lines for percent complete in a single call, one column per title. Interpolating inside
+    # each title's reading span keeps its line continuous across days it was not read
+    percent_complete = df.pivot_table(index='date', columns='title', values='percent_complete', aggfunc='last', observed=True)[titles]
+    percent_complete = percent_complete.interpolate(method='time', limit_area='inside')
+    lines = ax1.plot(percent_complete.index, percent_complete.to_numpy())
+    for line, title, color in zip(lines, titles, colors):
+        line.set_label(title)
+        line.set_color(color)
 
     # Label and style the axes
     # x-axis
@@ -100,17 +146,9 @@ def plot_stacked_bar_and_line_charts(df, year):
     end_date = df['date'].max() + pd.Timedelta(days=1)
     ax1.set_xlim(start_date, end_date)
 
-    # Calculate positions for every day of the year
-    all_days = pd.date_range(start_date, end_date)
-    all_day_positions = mdates.date2num(all_days)
-
-    # Calculate positions for each month's first day
-    month_starts = pd.date_range(start=f'{year}-01-01', end=f'{year}-12-31', freq='MS')
-    month_start_positions = mdates.date2num(month_starts)
-
-    # Set the tick positions and labels for the x-axis
-    ax1.set_xticks(month_start_positions)
-    ax1.set_xticklabels([date.strftime('%b') for date in month_starts], rotation=0, ha='left')
+    # Set the tick positions and labels for the x-axis at each month's first day
+    ax1.set_xticks(mdates.date2num(calendar['month_starts']))
+    ax1.set_xticklabels(calendar['month_labels'], rotation=0, ha='left')
 
     # Apply font styles to tick labels
     for label in ax1.get_xticklabels() + ax1.get_yticklabels():
@@ -125,60 +163,61 @@ def plot_stacked_bar_and_line_charts(df, year):
     # ax1.legend(fontsize=7, loc='lower left', bbox_to_anchor=(0, -.9), borderaxespad=0, ncol=3, frameon=False)
 
     # Add a title
-    plt.title(f'{year} YEAR IN READING - Daily Pages and Completion Progress Over Time', loc='left')
+    ax1.set_title(f'{year} YEAR IN READING - Daily Pages and Completion Progress Over Time', loc='left')
 
     # Return the figure
     return fig
 
-def plot_reading_heatmap(df, year):
-    # Filter data for the specified year
-    df = df[df['date'].dt.year == year]
-
+def plot_reading_heatmap(df, year, calendar, fig):
     # Ensure the data is aggregated by date, summing over the 'daily_pages' column
-    daily_data = df.groupby('date')['daily_pages'].sum().reset_index()
+    daily_data = df.groupby('date')['daily_pages'].sum()
     
     # Create a date range for the year
-    start_date = pd.Timestamp(f"{year}-01-01")
-    end_date = pd.Timestamp(f"{year}-12-31")
-    all_dates = pd.date_range(start=start_date, end=end_date)
+    all_dates = calendar['all_dates']
+    start_date = all_dates[0]
     
-    # Create a DataFrame with all dates in the year
-    calendar_df = pd.DataFrame({'date': all_dates})
-    
-    # Merge the reading data with the full year's date range, filling missing days with zeros
-    calendar_df = calendar_df.merge(daily_data, how='left', on='date').fillna(0)
+    # Reindex the reading data onto the full year's date range, filling missing days with zeros
+    calendar_df = daily_data.reindex(all_dates, fill_value=0).rename_axis('date').reset_index()
 
-    # Determine the first Monday of the year
-    first_monday = calendar_df[calendar_df['date'].dt.weekday == 0]['date'].min()
-    if first_monday > start_date:
-        first_monday -= pd.Timedelta(days=7)
+    # Determine the Monday on or before the first day of the year
+    first_monday = start_date - pd.Timedelta(days=start_date.weekday())
     
-    # Calculate week and day numbers for each date in the DataFrame
-    calendar_df['week'] = (calendar_df['date'] - first_monday).dt.days // 7 + 1
-    calendar_df['day'] = calendar_df['date'].dt.weekday
+    # Calculate week and day numbers for each date from its integer day offset to that Monday
+    day_offsets = (all_dates - first_monday).days.to_numpy()
+    calendar_df['week'] = day_offsets // 7 + 1
+    calendar_df['day'] = day_offsets % 7
 
     # Find the week number for the first day of each month
-    month_starts = pd.date_range(start=f'{year}-01-01', end=f'{year}-12-31', freq='MS')
-    month_weeks = ((month_starts - first_monday).days // 7 + 1).tolist()
+    month_weeks = ((calendar['month_starts'] - first_monday).days // 7 + 1).tolist()
     
-    # Pivot the DataFrame to prepare for the heatmap
-    heatmap_data = calendar_df.pivot(index="day", columns="week", values="daily_pages")
+    # Scatter the daily pages into a (day, week) grid to prepare for the heatmap; days outside the year stay NaN
+    n_weeks = int(calendar_df['week'].max())
+    grid = np.full((7, n_weeks), np.nan)
+    grid[calendar_df['day'].to_numpy(), calendar_df['week'].to_numpy() - 1] = calendar_df['daily_pages'].to_numpy()
+    heatmap_data = pd.DataFrame(grid, index=pd.RangeIndex(7, name='day'), columns=pd.RangeIndex(1, n_weeks + 1, name='week'))
     
-    # Create the heatmap plot
-    fig, ax = plt.subplots(figsize=(20, 2.5))  # Aspect ratio adjusted for visual clarity
+    # Create the heatmap plot, clearing the figure left over from the previous year
+    fig.clear()
+    ax = fig.add_subplot()
     cmap = sns.color_palette("Greens", as_cmap=True)
     cmap.set_under('white')  # Set color for zero values
     
     # Draw the heatmap with white cells for zeros and black lines for borders
-    formatted_annotation = heatmap_data.fillna(0).applymap(lambda x: f'{int(x):d}' if x != 0 else '')
-    sns.heatmap(heatmap_data, cmap=cmap, linewidths=0.5, linecolor='black', cbar=True, annot=formatted_annotation, fmt="", annot_kws={'fontsize':8}, square=True, vmax=75, ax=ax)
+    vmax = 75
+    sns.heatmap(heatmap_data, cmap=cmap, linewidths=0.5, linecolor='black', cbar=True, annot=False, square=True, vmax=vmax, ax=ax)
+
+    # Label only the days with pages read, switching to white text on the darker cells
+    vals = heatmap_data.fillna(0).to_numpy()
+    for y, x in zip(*np.nonzero(vals)):
+        ax.text(x + 0.5, y + 0.5, str(int(vals[y, x])), ha='center', va='center', fontsize=8,
+            color='white' if vals[y, x] > vmax / 2 else 'black')
     
     # Set the aspect of the plot to equal for square cells
     ax.set_aspect('equal')
     
     # Define the month's positions and labels for the x-axis
     ax.set_xticks(month_weeks)
-    ax.set_xticklabels([date.strftime('%b') for date in month_starts], ha='left')
+    ax.set_xticklabels(calendar['month_labels'], ha='left')
     ax.set_xlabel('')
     
     # Define the labels for the y-axis
@@ -188,38 +227,39 @@ def plot_reading_heatmap(df, year):
     ax.set_ylabel('')
     
     # Adjust the layout to add padding and display the plot clearly
-    plt.tight_layout(pad=2)
+    fig.tight_layout(pad=2)
 
     # Add a title
-    plt.title(f'{year} YEAR IN READING - Daily Pages', loc='left')
+    ax.set_title(f'{year} YEAR IN READING - Daily Pages', loc='left')
 
     return fig
 
-def plot_books_table(df, df_dailies, year):
+def plot_books_table(df, df_dailies, df_dailies_year, year, fig):
 
     # Filter df to only titles that were read at least one day this year, sort df
-    books_read_in_year = df_dailies[df_dailies['date'].dt.year == year]['title'].unique()
-    df = df[df['title'].isin(books_read_in_year) & df['status'].isin(['Completed', 'In progress'])]
-    df.sort_values(by='began', ascending=False, inplace=True)
+    books_read_in_year = df_dailies_year['title'].unique()
+    df = df.loc[df['title'].isin(books_read_in_year) & df['status'].isin(['Completed', 'In progress'])].sort_values(by='began', ascending=False, kind='stable')
 
-    # Aggregate the most recent percent_complete for each title in df_dailies
-    df_dailies = df_dailies.groupby('ean_isbn13')['percent_complete'].last().reset_index()
+    # Aggregate the most recent percent_complete for each book across all of df_dailies, so books
+    # finished after this year still show their latest progress
+    df_dailies = df_dailies[['ean_isbn13', 'percent_complete', 'date']].sort_values(by='date', kind='stable').drop_duplicates('ean_isbn13', keep='last')
 
     # Merge df_dailies with df, convert values to integers
-    df = df.merge(df_dailies, on='ean_isbn13', how='left')
-    df['percent_complete'] = df['percent_complete'].fillna(0).apply(lambda x: int(x))
+    df = df.merge(df_dailies[['ean_isbn13', 'percent_complete']], on='ean_isbn13', how='left', validate='many_to_one')
+    df['percent_complete'] = df['percent_complete'].fillna(0).astype(int)
 
     # Truncate long titles and authors
-    df['title'] = df['title'].apply(lambda x: x[:30] + '...' if len(x) > 30 else x)
-    df['creators'] = df['creators'].apply(lambda x: x[:30] + '...' if len(x) > 30 else x)
+    for column in ['title', 'creators']:
+        df[column] = df[column].where(df[column].str.len() <= 30, df[column].str.slice(0, 30) + '...')
 
     # Replace "NaT" with "-" and format dates
-    df['completed'] = df['completed'].apply(lambda x: x.strftime('%Y-%b-%d') if pd.notna(x) else '-')
+    df['completed'] = df['completed'].dt.strftime('%Y-%b-%d').fillna('-')
     df['began'] = df['began'].dt.strftime('%Y-%b-%d')
     df['duration'] = df['duration'].replace({0: '-'})
 
-    # Create the table plot
-    fig, ax = plt.subplots(figsize=(20, 10))
+    # Create the table plot, clearing the figure left over from the previous year
+    fig.clear()
+    ax = fig.add_subplot()
 
     ncols = 7
     nrows = df.shape[0]
@@ -229,48 +269,54 @@ def plot_books_table(df, df_dailies, year):
 
     positions = [0, 2.25, 3.25, 4.25, 5.25, 6.25, 7.25]
     columns = ['title', 'creators', 'length', 'began', 'completed', 'percent_complete', 'duration']
-
-    for i in range (nrows):
-        for j, column in enumerate(columns):
-            text_ha = 'left' if j == 0 else 'center'
-            text_label = f'{df[column].iloc[i]}'
-
-            if column == 'percent_complete':
-                # Draw a bar chart in the cell
-                completion = df[column].iloc[i] / 100  # Convert percentage to a fraction
-                cell_width = positions[j+1] - positions[j]  # Calculate the full cell width
-                rect_x_start = positions[j] - cell_width / 3  # Adjust to get the left edge
-                rect_width = completion * cell_width * .7  # Calculate the width of the rectangle based on the % complete
-                color = sns.color_palette("Greens")[int(completion * (len(sns.color_palette("Greens")) - 1))]
-                rect = patches.Rectangle((rect_x_start, i), rect_width, 1, color=color)
-                ax.add_patch(rect)
-                # Add text overlay on the rectangle
-                ax.text(positions[j], i + 0.5, f'{df[column].iloc[i]}%', 
-                    ha='center', va='center', color='white' if completion > 0.5 else 'black')
-                continue
-
-            ax.annotate(
-                text=text_label,
-                xy=(positions[j], i + 0.5),
-                ha=text_ha,
-                va='center',
-                fontsize=10,
-            )
-
     column_names = ['Title', 'Authors', 'Pages', 'Began', 'Completed', '% Complete', 'Time to Complete (Days)']
-    
-    for index, c in enumerate(column_names):
-        if index == 0:
-            ha = 'left'
-        else:
-            ha = 'center'
-        ax.annotate(
-            xy=(positions[index], nrows + .25),
-            text=column_names[index],
-            ha=ha,
-            va='bottom',
-            weight='bold'
-        )
+    percent_col = columns.index('percent_complete')
+
+    # Cell text, with the header first and the rows reversed so that the first row of df sits at the
+    # bottom of the table. The header is drawn as a regular row so that years without books still get one
+    cells = df[columns].astype(str)
+    cells['percent_complete'] = cells['percent_complete'] + '%'
+    cell_text = np.vstack([column_names, cells.to_numpy()[::-1]])
+
+    # Draw all cells with two table calls: a left-aligned title column and the remaining
+    # centered columns. Each row spans one unit in data coordinates, header included
+    title_width = positions[1] - 0.5
+    tables = [
+        ax.table(
+            cellText=cell_text[:, :1].tolist(),
+            cellColours=[['none']] * (nrows + 1),
+            cellLoc='left',
+            edges='open',
+            bbox=[0, 0, title_width / (ncols + 1), 1]
+        ),
+        ax.table(
+            cellText=cell_text[:, 1:].tolist(),
+            cellColours=[['none'] * (ncols - 1)] * (nrows + 1),
+            cellLoc='center',
+            edges='open',
+            bbox=[title_width / (ncols + 1), 0, (ncols - 1) / (ncols + 1), 1]
+        ),
+    ]
+    for tbl, labels in zip(tables, [column_names[:1], column_names[1:]]):
+        tbl.auto_set_font_size(False)
+        tbl.set_fontsize(10)
+        tbl.set_zorder(3)
+        for j in range(len(labels)):
+            tbl[(0, j)].set_text_props(weight='bold')
+
+    # Palette for the percent complete bars
+    greens = sns.color_palette("Greens")
+    n_greens = len(greens) - 1
+
+    # Draw a bar chart in each percent complete cell, under the table text
+    cell_width = positions[percent_col + 1] - positions[percent_col]  # Calculate the full cell width
+    rect_x_start = positions[percent_col] - cell_width / 3  # Adjust to get the left edge
+    for i, percent in enumerate(df['percent_complete'].to_numpy()):
+        completion = percent / 100  # Convert percentage to a fraction
+        rect_width = completion * cell_width * .7  # Calculate the width of the rectangle based on the % complete
+        rect = patches.Rectangle((rect_x_start, i), rect_width, 1, color=greens[int(completion * n_greens)])
+        ax.add_patch(rect)
+        tables[1][(nrows - i, percent_col - 1)].get_text().set_color('white' if completion > 0.5 else 'black')
 
     # Add dividing lines
     ax.plot([ax.get_xlim()[0], ax.get_xlim()[1]], [nrows, nrows], lw=1.5, color='black', marker='', zorder=4)
@@ -286,7 +332,7 @@ def plot_books_table(df, df_dailies, year):
     ax.set_ylabel('')
 
     # Add a title
-    plt.title(f'{year} YEAR IN READING - Books Read ≥ 1 Day', loc='left')
+    ax.set_title(f'{year} YEAR IN READING - Books Read ≥ 1 Day', loc='left')
 
     return fig
 
@@ -294,9 +340,10 @@ def save_plot(
     figure,
     file_name,
     output_dir=config['output_paths']['figures'],
-    dpi=300,
+    dpi=100,
     transparent=True,
     bbox_inches='tight',
+    compress_level=1,
 ):
     """
     Save a matplotlib figure to a file.
@@ -308,6 +355,7 @@ def save_plot(
         dpi (int): The DPI (dots per inch) for the saved image.
         transparent (bool): Whether the saved image should have a transparent background.
         bbox_inches (str or Bbox): Bounding box in inches: 'tight' or Bbox object.
+        compress_level (int): The zlib compression level (0-9) for PNG output; lower is faster.
     """
 
     # Get global facecolors
@@ -319,7 +367,8 @@ def save_plot(
         dpi=dpi,
         transparent=transparent,
         bbox_inches=bbox_inches,
-        facecolor=global_figure_facecolor
+        facecolor=global_figure_facecolor,
+        pil_kwargs={'compress_level': compress_level}
     )
 
 def main():
@@ -327,25 +376,53 @@ def main():
     data_paths = config.get('input_paths', {})
 
     # Import data into DataFrames
-    df_dailies = pd.read_csv(data_paths.get('dailies', ''))
-    df_library = pd.read_csv(data_paths.get('library', ''))
+    df_dailies = read_zsr_output(
+        data_paths.get('dailies', ''),
+        engine='pyarrow',
+        usecols=['date', 'ean_isbn13', 'title', 'daily_pages', 'percent_complete'],
+        parse_dates=['date'],
+        dtype={'ean_isbn13': str, 'title': str, 'daily_pages': 'float32', 'percent_complete': 'float32'}
+    )
+    df_library = read_zsr_output(
+        data_paths.get('library', ''),
+        usecols=['title', 'creators', 'length', 'began', 'completed', 'duration', 'status', 'ean_isbn13'],
+        parse_dates=['began', 'completed'],
+        date_format='%Y-%m-%d',
+        dtype={'ean_isbn13': str}
+    )
 
     # Clean and transform data
-    clean_data(df_library, df_dailies)
+    df_library, df_dailies = clean_data(df_library, df_dailies)
 
-    # Find years in dataset
-    years = df_dailies['date'].dt.year.unique()
+    # Split the dailies by year once rather than filtering the full frame in every plot
+    df_dailies['year'] = df_dailies['date'].dt.year
+    dailies_by_year = {year: df_year for year, df_year in df_dailies.groupby('year', sort=False)}
 
-    #Create and save plots for each year
-    for year in years:
-        fig1 = plot_stacked_bar_and_line_charts(df_dailies, year)
-        save_plot(fig1, f'overlay-chart-{year}.png')
-
-        fig2 = plot_reading_heatmap(df_dailies, year)
-        save_plot(fig2, f'daily-pages-{year}.png')
+    # Create one figure per plot type and reuse it for every year
+    fig1 = plt.figure(figsize=(20, 2.5))
+    fig2 = plt.figure(figsize=(20, 2.5))  # Aspect ratio adjusted for visual clarity
+    fig3 = plt.figure(figsize=(20, 10))
 
-        fig3 = plot_books_table(df_library, df_dailies, year)
-        save_plot(fig3, f'books-table-{year}.png')
+    #Create and save plots for each year
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        for year, df_year in dailies_by_year.items():
+            calendar = year_calendar(year)
+
+            plot_stacked_bar_and_line_charts(df_year, year, calendar, fig1)
+            plot_reading_heatmap(df_year, year, calendar, fig2)
+            plot_books_table(df_library, df_dailies, df_year, year, fig3)
+
+            # Save the finished figures concurrently, waiting for all three before they are cleared for the next year
+            saves = [
+                executor.submit(save_plot, fig1, f'overlay-chart-{year}.png'),
+                executor.submit(save_plot, fig2, f'daily-pages-{year}.png'),
+                executor.submit(save_plot, fig3, f'books-table-{year}.png')
+            ]
+            for save in saves:
+                save.result()
+
+    for fig in (fig1, fig2, fig3):
+        plt.close(fig)
 
 if __name__ == "__main__":
     main()